@@ -1,11 +1,27 @@
-from __future__ import absolute_import
 import sys
+from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QSurfaceFormat
 from PyQt5.QtWidgets import QApplication
 
-from .main_window import MoulderApp
+
+def __getattr__(name):
+    # Import the main window (and matplotlib with it) only when it's used
+    if name == 'MoulderApp':
+        from .main_window import MoulderApp
+        return MoulderApp
+    raise AttributeError(
+        "module {!r} has no attribute {!r}".format(__name__, name))
 
 
 def main():
+    # These only take effect if set before the QApplication is created
+    QApplication.setAttribute(Qt.AA_ShareOpenGLContexts, True)
+    QApplication.setAttribute(Qt.AA_UseHighDpiPixmaps, True)
+    surface_format = QSurfaceFormat()
+    surface_format.setSwapInterval(1)
+    surface_format.setDepthBufferSize(0)
+    QSurfaceFormat.setDefaultFormat(surface_format)
+    from .main_window import MoulderApp
     app = QApplication(sys.argv)
     app.setApplicationName("Moulder")
     moulder_app = MoulderApp()
@@ -0,0 +1,82 @@
+"""
+Numba implementation of the Talwani forward model for 2D polygons.
+
+Used by :class:`~moulder.moulder.Moulder` instead of
+:func:`fatiando.gravmag.talwani.gz` when numba is installed.
+"""
+
+import math
+import numpy
+import numba
+
+from fatiando.constants import G, SI2MGAL
+
+
+@numba.njit(parallel=True, fastmath=True, cache=True)
+def gz(x, z, vertices_x, vertices_z, offsets, densities, out=None):
+    """
+    Calculate the gravity anomaly of a set of 2D polygons.
+
+    The vertices of all polygons are packed in two contiguous arrays: the
+    vertices of the i-th polygon are in the slice ``offsets[i]:offsets[i +
+    1]``. The polygons can be oriented either way.
+
+    Parameters:
+
+    * x, z : 1d-arrays
+        The x and z coordinates of the computation points (z is positive
+        downward)
+    * vertices_x, vertices_z : 1d-arrays
+        The x and z coordinates of the vertices of all polygons
+    * offsets : 1d-array of int
+        The index of the first vertex of each polygon, followed by the total
+        number of vertices
+    * densities : 1d-array
+        The density of each polygon
+    * out : 1d-array or None
+        If given, the result is written to this array instead of a new one
+
+    Returns:
+
+    * gz : 1d-array
+        The vertical component of the gravitational attraction in mGal
+
+    """
+    npoints = x.size
+    npolygons = densities.size
+    # Fold the orientation of each polygon (the sign of its area) into its
+    # density so the result doesn't depend on it
+    scale = numpy.empty(npolygons)
+    for p in range(npolygons):
+        start, end = offsets[p], offsets[p + 1]
+        area = 0.
+        for k in range(start, end):
+            knext = k + 1 if k + 1 < end else start
+            area += (vertices_x[k]*vertices_z[knext] -
+                     vertices_x[knext]*vertices_z[k])
+        scale[p] = densities[p] if area > 0 else -densities[p]
+    if out is None:
+        result = numpy.empty(npoints)
+    else:
+        result = out
+    for i in numba.prange(npoints):
+        total = 0.
+        for p in range(npolygons):
+            start, end = offsets[p], offsets[p + 1]
+            polygon_total = 0.
+            for k in range(start, end):
+                knext = k + 1 if k + 1 < end else start
+                x1, z1 = vertices_x[k] - x[i], vertices_z[k] - z[i]
+                x2, z2 = vertices_x[knext] - x[i], vertices_z[knext] - z[i]
+                cross = x2*z1 - x1*z2
+                # Sides aligned with the computation point don't contribute
+                if cross == 0:
+                    continue
+                dx, dz = x2 - x1, z2 - z1
+                dtheta = math.atan2(-cross, x1*x2 + z1*z2)
+                log_ratio = 0.5*math.log((x1*x1 + z1*z1)/(x2*x2 + z2*z2))
+                polygon_total += (cross/(dx*dx + dz*dz) *
+                                  (dx*dtheta + dz*log_ratio))
+            total += scale[p]*polygon_total
+        result[i] = 2*G*SI2MGAL*total
+    return result
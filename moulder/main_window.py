@@ -1,19 +1,21 @@
-from __future__ import print_function, division, absolute_import
-from future.builtins import super
-
 import sys
 import numpy
 from matplotlib.backends.backend_qt5 import NavigationToolbar2QT
 from PyQt5.QtGui import QIcon
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QSignalBlocker, QThreadPool
 from PyQt5.QtWidgets import QMainWindow, QAction
 from PyQt5.QtWidgets import QWidget, QVBoxLayout, QMessageBox, QDoubleSpinBox
 from PyQt5.QtWidgets import QSlider, QLabel
 
-from .ui import QDoubleSlider, ConfigureMeassurementDialog
+from .ui import QDoubleSlider
 from .moulder import Moulder
 
 DENSITY_RANGE = [-2000, 2000]
+# Default measurement points. Read-only since they are shared by every window.
+DEFAULT_X = numpy.linspace(0, 100e3, 101)
+DEFAULT_X.flags.writeable = False
+DEFAULT_Z = numpy.zeros(101)
+DEFAULT_Z.flags.writeable = False
 
 
 class MoulderApp(QMainWindow):
@@ -23,12 +25,14 @@ class MoulderApp(QMainWindow):
         self.setWindowTitle("Moulder")
         self.setWindowIcon(QIcon.fromTheme('python-logo'))
         self.setGeometry(200, 200, 1024, 700)
+        # Created the first time it's opened (see
+        # _configure_meassurement_callback)
+        self._configure_dialog = None
         self.init_ui()
 
         widget = QWidget()
         layout = QVBoxLayout()
-        self.moulder = Moulder(self, numpy.linspace(0, 100e3, 101),
-                               numpy.zeros(101), 0, 10000,
+        self.moulder = Moulder(self, DEFAULT_X, DEFAULT_Z, 0, 10000,
                                density_range=DENSITY_RANGE,
                                width=5, height=4, dpi=100)
         self.moulder.setFocusPolicy(Qt.StrongFocus)
@@ -62,13 +66,11 @@ class MoulderApp(QMainWindow):
         self.delete_polygon_action.triggered.connect(
             self.moulder.delete_polygon)
         self.density_slider.valueChanged.connect(
-            self._spin_slider_changed_callback)
+            self._density_slider_callback)
         self.density_spinbox.valueChanged.connect(
-            self._spin_slider_changed_callback)
-        self.error_slider.valueChanged.connect(
-            self._spin_slider_changed_callback)
-        self.error_spinbox.valueChanged.connect(
-            self._spin_slider_changed_callback)
+            self._density_spinbox_callback)
+        self.error_slider.valueChanged.connect(self._error_slider_callback)
+        self.error_spinbox.valueChanged.connect(self._error_spinbox_callback)
 
     def _add_vertex_mode_callback(self, add_vertex):
         if add_vertex and self.add_vertex_action.isChecked() is False:
@@ -140,7 +142,7 @@ class MoulderApp(QMainWindow):
         self.density_slider.setMaximum(DENSITY_RANGE[1])
         self.density_slider.setValue(0)
         self.density_slider.setTickInterval(
-            (DENSITY_RANGE[1] - DENSITY_RANGE[0])/10)
+            (DENSITY_RANGE[1] - DENSITY_RANGE[0])//10)
         self.density_slider.setTickPosition(QSlider.TicksBelow)
         self.density_spinbox = QDoubleSpinBox()
         self.density_spinbox.setMinimum(DENSITY_RANGE[0])
@@ -173,35 +175,50 @@ class MoulderApp(QMainWindow):
                           "About Moulder\nVersion 0.1")
 
     def _configure_meassurement_callback(self):
-        configure_dialog = ConfigureMeassurementDialog(self)
+        if self._configure_dialog is None:
+            from .ui import ConfigureMeassurementDialog
+            self._configure_dialog = ConfigureMeassurementDialog(self)
+        configure_dialog = self._configure_dialog
         configure_dialog.exec_()
         if configure_dialog.is_completed():
             self.moulder.set_meassurement_points(configure_dialog.x,
                                                  configure_dialog.z)
 
-    def _spin_slider_changed_callback(self, value):
-        sender = self.sender()
-        if sender == self.density_slider:
+    def _density_slider_callback(self, value):
+        with QSignalBlocker(self.density_spinbox):
             self.density_spinbox.setValue(value)
-            self.moulder.density = value
-        elif sender == self.density_spinbox:
-            self.density_slider.setValue(value)
-            self.moulder.density = value
-        elif sender == self.error_slider:
-            value = self.error_slider.int_2_float(value)
+        self.moulder.density = value
+
+    def _density_spinbox_callback(self, value):
+        with QSignalBlocker(self.density_slider):
+            self.density_slider.setValue(round(value))
+        self.moulder.density = value
+
+    def _error_slider_callback(self, value):
+        value = self.error_slider.int_2_float(value)
+        with QSignalBlocker(self.error_spinbox):
             self.error_spinbox.setValue(value)
-            self.moulder.error = value
-        elif sender == self.error_spinbox:
+        self.moulder.error = value
+
+    def _error_spinbox_callback(self, value):
+        with QSignalBlocker(self.error_slider):
             self.error_slider.setValue(self.error_slider.float_2_int(value))
-            self.moulder.error = value
+        self.moulder.error = value
 
     def _change_density_callback(self, value):
-        self.density_spinbox.setValue(value)
-        self.density_slider.setValue(value)
+        if value == self.density_spinbox.value():
+            return
+        # Only sync the widgets, their callbacks would modify the model
+        with QSignalBlocker(self.density_spinbox):
+            self.density_spinbox.setValue(value)
+        with QSignalBlocker(self.density_slider):
+            self.density_slider.setValue(round(value))
 
     def _quit_callback(self):
         answer = QMessageBox.question(self, "Quit",
                                       "Are you sure you want to quit?",
                                       QMessageBox.Yes, QMessageBox.No)
         if answer == QMessageBox.Yes:
+            # Let a running forward model finish before Python shuts down
+            QThreadPool.globalInstance().waitForDone()
             sys.exit()
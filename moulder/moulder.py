@@ -1,26 +1,97 @@
-from __future__ import division, absolute_import
-from future.builtins import super, zip
-
 import numpy
 from matplotlib import pyplot, patches
 from matplotlib.lines import Line2D
 from matplotlib.figure import Figure
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
-from PyQt5.QtCore import Qt, pyqtSignal
+from PyQt5.QtCore import Qt, QObject, QRunnable, QThreadPool, QTimer
+from PyQt5.QtCore import pyqtSignal
 
-from fatiando import utils
 from fatiando.gravmag import talwani
 from fatiando.mesher import Polygon
 
+try:
+    import numba
+    from . import _talwani_numba
+except ImportError:
+    _talwani_numba = None
+
 LINE_ARGS = dict(
     linewidth=2, linestyle='-', color='k', marker='o',
     markerfacecolor='k', markersize=5, animated=False, alpha=0.6)
 
+# The Moulder method called when each key is pressed (see keyPressEvent)
+KEY_ACTIONS = {
+    Qt.Key_D: 'delete_polygon',
+    Qt.Key_N: 'new_polygon',
+    Qt.Key_Escape: 'cancel_drawing',
+    Qt.Key_R: 'reset_view',
+    Qt.Key_A: 'add_vertex',
+}
+
+# Generates the noise added to the predicted data. Only used by one forward
+# model task at a time.
+_rng = numpy.random.default_rng()
+
+
+def _talwani_gz(x, z, model, out=None):
+    """
+    Wrap :func:`fatiando.gravmag.talwani.gz` to write the result to *out*.
+    """
+    if out is None:
+        return talwani.gz(x, z, model)
+    out[:] = talwani.gz(x, z, model)
+    return out
+
+
+class _ForwardModelSignals(QObject):
+    """
+    Signals emitted by :class:`_ForwardModelTask`.
+    """
+    # Sends the request id, the predicted data and its min and max values
+    finished = pyqtSignal(int, object, float, float)
+
+
+class _ForwardModelTask(QRunnable):
+    """
+    Compute the gravity anomaly of a polygon model in a worker thread.
+
+    The predicted data is written to the *out* buffer and the noise is
+    generated in the *noise* buffer, so the data arrays are reused across
+    runs. The forward model can still allocate its own temporary arrays
+    (the fatiando fallback computes a new array that is copied to *out*),
+    and *args* holds copies of the model taken when the task is created.
+    """
+
+    def __init__(self, request_id, forward, args, error, out, noise):
+        super().__init__()
+        self.request_id = request_id
+        self.forward = forward
+        self.args = args
+        self.error = error
+        self.out = out
+        self.noise = noise
+        self.signals = _ForwardModelSignals()
+
+    def run(self):
+        predicted = self.forward(*self.args, out=self.out)
+        if self.error > 0:
+            _rng.standard_normal(out=self.noise)
+            self.noise *= self.error
+            predicted += self.noise
+        self.signals.finished.emit(self.request_id, predicted,
+                                   predicted.min(), predicted.max())
+
 
 class Moulder(FigureCanvasQTAgg):
 
     # The tolerance range for mouse clicks on vertices. In pixels.
     epsilon = 5
+    # Time to wait for the sliders to settle before recomputing the forward
+    # model. In milliseconds.
+    update_delay = 30
+    # Fraction of the data axes range by which the fitted limits can differ
+    # from the current ones before the axes are rescaled
+    ylim_tolerance = 0.05
     # App instructions printed in the figure suptitle
     instructions = ' | '.join([
         'n: New polygon', 'd: delete', 'click: select/move', 'a: add vertex',
@@ -37,19 +108,48 @@ class Moulder(FigureCanvasQTAgg):
         self.dataax, self.modelax = self.fig.subplots(2, 1, sharex=True)
         super().__init__(self.fig)
         self.setParent(parent)
+        if (_talwani_numba is not None and
+                numba.config.THREADING_LAYER == 'default'):
+            # The numba forward model runs from a worker thread. Parallel
+            # regions launched by the TBB threading layer outside of the main
+            # thread hang the interpreter on exit, so use the workqueue layer
+            # unless the user picked one (NUMBA_THREADING_LAYER). Note that
+            # this changes the numba configuration of the whole process.
+            numba.config.THREADING_LAYER = 'workqueue'
 
         self.min_depth, self.max_depth = min_depth, max_depth
-        self._x, self._z = x, z
+        self.x, self.z = x, z
         self.density_range = density_range
-        self._predicted = numpy.zeros_like(x)
+        self._allocate_buffers()
+        self._predicted_range = (0, 0)
         self._data = None
         self.predicted_line = None
+        self._dataax_bg = None
         self.cmap = pyplot.cm.RdBu_r
+        # Lookup table with the RGBA colors of the colormap
+        self._cmap_lut = self.cmap(numpy.arange(self.cmap.N))
         self.canvas = self.fig.canvas
 
         self.polygons = []
         self.lines = []
         self.densities = []
+        # The fatiando Polygon of each polygon and the polygons that changed
+        # since it was built (see model)
+        self._model_cache = []
+        self._dirty_polys = set()
+        # The vertices of all polygons stored as contiguous x and z columns
+        # (without repeating the first vertex at the end). The vertices of
+        # the i-th polygon are in the slice offsets[i]:offsets[i + 1] (see
+        # _polygon_slice). The patches and lines are synced from them.
+        self._verts_x = numpy.empty(0)
+        self._verts_z = numpy.empty(0)
+        self._poly_offsets = numpy.zeros(1, dtype=numpy.int32)
+        # Display coordinates of the vertices of all polygons, the bounds of
+        # the model axes they were computed for and the polygons that were
+        # moved since (see _get_vertices_display)
+        self._vertices_display = None
+        self._vertices_display_bounds = None
+        self._moved_polygons = set()
 
         # Initialize density and error values
         self._density = 0
@@ -59,6 +159,18 @@ class Moulder(FigureCanvasQTAgg):
         # They will be determined when data is imported
         self.dmin, self.dmax = 0, 0
 
+        # The forward model runs in a worker thread (see _update_data)
+        self._request_id = 0
+        self._forward_task = None
+        self._pending_task = None
+
+        # Coalesce bursts of density and error changes into a single update
+        self._model_changed = False
+        self._update_timer = QTimer(self)
+        self._update_timer.setSingleShot(True)
+        self._update_timer.setInterval(self.update_delay)
+        self._update_timer.timeout.connect(self._delayed_update_callback)
+
         self._figure_setup()
         self._init_markers()
         self._connect()
@@ -69,7 +181,10 @@ class Moulder(FigureCanvasQTAgg):
 
     @x.setter
     def x(self, new_value):
-        self._x = numpy.asarray(new_value)
+        # Keep the coordinates in double precision. Both forward models
+        # compute in the dtype of the points.
+        self._x = numpy.asarray(new_value, dtype=numpy.float64)
+        self._x_min, self._x_max = self._x.min(), self._x.max()
 
     @property
     def z(self):
@@ -77,7 +192,7 @@ class Moulder(FigureCanvasQTAgg):
 
     @z.setter
     def z(self, new_value):
-        self._z = numpy.asarray(new_value)
+        self._z = numpy.asarray(new_value, dtype=numpy.float64)
 
     @property
     def data(self):
@@ -97,12 +212,17 @@ class Moulder(FigureCanvasQTAgg):
         Callback when density slider is edited
         """
         self._density = value
-        if self._ipoly is not None:
+        if self._ipoly is not None and self.densities[self._ipoly] != value:
             self.densities[self._ipoly] = value
+            # Rebuild the Polygon instead of changing its props in place
+            # because a running forward model task may be using it
+            self._dirty_polys.add(self._ipoly)
             self.polygons[self._ipoly].set_color(self._density2color(value))
-            # self._update_data()
-            self._update_data_plot()
-            self.canvas.draw()
+            # Show the new color right away on top of the cached background
+            # and only fall back to a redraw if there isn't one
+            if not self._blit_selected_polygon():
+                self._model_changed = True
+            self._update_timer.start()
 
     @property
     def error(self):
@@ -113,24 +233,37 @@ class Moulder(FigureCanvasQTAgg):
         """
         Callback when error slider is edited
         """
+        if value == self._error:
+            return
         self._error = value
-        self._update_data_plot()
+        self._update_timer.start()
 
     @property
     def predicted(self):
-        self._predicted = talwani.gz(self.x, self.z, self.model)
-        if self.error > 0:
-            self._predicted = utils.contaminate(self._predicted, self.error)
-        return self._predicted
+        """
+        The predicted data of the last forward model run (read-only).
+
+        This is a view of one of the buffers the forward model alternates
+        between, so later runs overwrite it. Copy it to keep the values.
+        """
+        predicted = self._predicted.view()
+        predicted.flags.writeable = False
+        return predicted
 
     @property
     def model(self):
         """
         The polygon model drawn as :class:`fatiando.mesher.Polygon` objects.
+
+        Only the polygons in *_dirty_polys* (the ones added or with vertices
+        or density changed since the last call) are rebuilt.
         """
-        m = [Polygon(p.xy, {'density': d}, force_clockwise=True)
-             for p, d in zip(self.polygons, self.densities)]
-        return m
+        for i in self._dirty_polys:
+            self._model_cache[i] = Polygon(
+                self._polygon_vertices(i), {'density': self.densities[i]},
+                force_clockwise=True)
+        self._dirty_polys.clear()
+        return list(self._model_cache)
 
     def add_vertex(self):
         self._add_vertex = not self._add_vertex
@@ -139,12 +272,9 @@ class Moulder(FigureCanvasQTAgg):
     def new_polygon(self):
         self._ivert = None
         self._ipoly = None
-        for line, poly in zip(self.lines, self.polygons):
-            poly.set_animated(False)
-            line.set_animated(False)
-            line.set_color([0, 0, 0, 0])
+        self._clear_highlight()
         self.canvas.draw()
-        self.background = self.canvas.copy_from_bbox(self.modelax.bbox)
+        self._take_background(None)
         self._drawing = True
         self.drawing_mode.emit(self._drawing)
         self._xy = []
@@ -154,32 +284,29 @@ class Moulder(FigureCanvasQTAgg):
         self.dataax.set_title(' | '.join([
             'left click: set vertice', 'right click: finish',
             'esc: cancel']))
-        self.canvas.draw()
+        self.canvas.draw_idle()
 
     def delete_polygon(self):
         if self._drawing and self._xy:
             self._xy.pop()
             if self._xy:
-                self._drawing_plot.set_data(list(zip(*self._xy)))
+                self._drawing_plot.set_data(*numpy.transpose(self._xy))
             else:
                 self._drawing_plot.set_data([], [])
-            self.canvas.restore_region(self.background)
-            self.modelax.draw_artist(self._drawing_plot)
-            self.canvas.blit(self.modelax.bbox)
+            self._blit_drawing()
         elif self._ivert is not None:
-            poly = self.polygons[self._ipoly]
-            line = self.lines[self._ipoly]
-            if len(poly.xy) > 4:
-                verts = numpy.atleast_1d(self._ivert)
-                poly.xy = numpy.array([xy for i, xy in enumerate(poly.xy)
-                                       if i not in verts])
-                line.set_data(list(zip(*poly.xy)))
-                # self._update_data()
-                self._update_data_plot()
-                self.canvas.restore_region(self.background)
-                self.modelax.draw_artist(poly)
-                self.modelax.draw_artist(line)
-                self.canvas.blit(self.modelax.bbox)
+            verts = self._polygon_slice(self._ipoly)
+            if verts.stop - verts.start > 3:
+                keep = numpy.ones(len(self._verts_x), dtype=bool)
+                keep[verts.start + self._ivert] = False
+                self._verts_x = self._verts_x[keep]
+                self._verts_z = self._verts_z[keep]
+                self._poly_offsets[self._ipoly + 1:] -= 1
+                self._sync_polygon(self._ipoly)
+                self._vertices_display = None
+                self._dirty_polys.add(self._ipoly)
+                self._update_data()
+                self._blit_polygon(self._ipoly)
                 self._ivert = None
         elif self._ipoly is not None:
             self.polygons[self._ipoly].remove()
@@ -187,10 +314,26 @@ class Moulder(FigureCanvasQTAgg):
             self.polygons.pop(self._ipoly)
             self.lines.pop(self._ipoly)
             self.densities.pop(self._ipoly)
+            self._model_cache.pop(self._ipoly)
+            self._dirty_polys = set(i - 1 if i > self._ipoly else i
+                                    for i in self._dirty_polys
+                                    if i != self._ipoly)
+            verts = self._polygon_slice(self._ipoly)
+            self._verts_x = numpy.delete(self._verts_x, verts)
+            self._verts_z = numpy.delete(self._verts_z, verts)
+            self._poly_offsets = numpy.delete(self._poly_offsets,
+                                              self._ipoly + 1)
+            self._poly_offsets[self._ipoly + 1:] -= verts.stop - verts.start
+            if self._animated_idx == self._ipoly:
+                self._animated_idx = None
+            elif (self._animated_idx is not None and
+                    self._animated_idx > self._ipoly):
+                self._animated_idx -= 1
+            self._vertices_display = None
+            self.background = None
             self._ipoly = None
-            self.canvas.draw()
-            # self._update_data()
-            self._update_data_plot()
+            self.canvas.draw_idle()
+            self._update_data()
             self.add_vertex_mode.emit(False)
 
     def cancel_drawing(self):
@@ -205,17 +348,34 @@ class Moulder(FigureCanvasQTAgg):
             if self._drawing_plot is not None:
                 self._drawing_plot.remove()
                 self._drawing_plot = None
-            for line, poly in zip(self.lines, self.polygons):
-                poly.set_animated(False)
-                line.set_animated(False)
-                line.set_color([0, 0, 0, 0])
-        self.canvas.draw()
+            self._clear_highlight()
+        self.canvas.draw_idle()
+
+    def reset_view(self):
+        self.modelax.set_xlim(self._x_min, self._x_max)
+        self.modelax.set_ylim(self.max_depth, self.min_depth)
+        self._update_data_plot()
 
     def set_meassurement_points(self, x, z):
         self.x = x
         self.z = z
+        # The predicted data is plotted once the forward model finishes
+        self._allocate_buffers()
+        self._predicted_range = (0, 0)
         self._figure_setup()
-        self._update_data_plot()
+        self._update_data()
+
+    def _allocate_buffers(self):
+        """
+        Allocate the buffers for the predicted data and its noise.
+
+        The forward model alternates between two buffers for the predicted
+        data so it never writes to the one that is plotted.
+        """
+        self._predicted_buffers = (numpy.zeros(self.x.shape),
+                                   numpy.zeros(self.x.shape))
+        self._noise_buffer = numpy.empty(self.x.shape)
+        self._predicted = self._predicted_buffers[0]
 
     def _figure_setup(self):
         self.dataax.set_title(self.instructions)
@@ -224,14 +384,17 @@ class Moulder(FigureCanvasQTAgg):
         self.dataax.grid(True)
         self.modelax.set_xlabel("x [m]")
         self.modelax.set_ylabel("z [m]")
-        self.modelax.set_xlim(self.x.min(), self.x.max())
+        self.modelax.set_xlim(self._x_min, self._x_max)
         self.modelax.set_ylim(self.min_depth, self.max_depth)
         self.modelax.grid(True)
         self.modelax.invert_yaxis()
         if self.predicted_line is not None:
             self.predicted_line.remove()
-        self.predicted_line, = self.dataax.plot(self.x, self.predicted, '-r')
-        self.canvas.draw()
+        # The predicted line is animated so it can be blitted on top of a
+        # cached background of the data axes (see _draw_callback)
+        self.predicted_line, = self.dataax.plot(self.x, self.predicted, '-r',
+                                                animated=True)
+        self.canvas.draw_idle()
 
     def _init_markers(self):
         self._ivert = None
@@ -242,7 +405,15 @@ class Moulder(FigureCanvasQTAgg):
         self._add_vertex = False
         self._xy = []
         self._drawing_plot = None
+        # The polygon that is highlighted (animated and/or with a visible
+        # contour) so only it has to be reset
+        self._animated_idx = None
+        # Snapshot of the model axes used for blitting, the polygon it was
+        # taken for (the selected polygon is left out of the snapshot) and
+        # the bounds of the axes when it was taken
         self.background = None
+        self._background_ipoly = None
+        self._background_bounds = None
 
     def _connect(self):
         """
@@ -255,11 +426,65 @@ class Moulder(FigureCanvasQTAgg):
                                 self._button_release_callback)
         self.canvas.mpl_connect('motion_notify_event',
                                 self._mouse_move_callback)
+        self.canvas.mpl_connect('draw_event', self._draw_callback)
+        self.canvas.mpl_connect('resize_event', self._resize_callback)
+        self.modelax.callbacks.connect('xlim_changed',
+                                       self._limits_changed_callback)
+        self.modelax.callbacks.connect('ylim_changed',
+                                       self._limits_changed_callback)
+        # The x axis is shared, but older matplotlib versions don't notify the
+        # modelax when the dataax is zoomed or panned
+        self.dataax.callbacks.connect('xlim_changed',
+                                      self._limits_changed_callback)
+
+    def _draw_callback(self, event):
+        """
+        Cache the backgrounds of the axes after every full redraw.
+
+        The predicted line, the polygon being drawn and the selected polygon
+        are animated, so they have to be drawn on top of the freshly captured
+        backgrounds.
+        """
+        # Figures saved to files are drawn with the animated artists and at
+        # their own resolution (sometimes without a renderer to blit with)
+        if event.canvas.is_saving():
+            return
+        self._dataax_bg = self.canvas.copy_from_bbox(self.dataax.bbox)
+        self.dataax.draw_artist(self.predicted_line)
+        if self._drawing and self._drawing_plot is not None:
+            self._take_background(None)
+            self.modelax.draw_artist(self._drawing_plot)
+        elif (self._ipoly is not None and
+                self.polygons[self._ipoly].get_animated()):
+            self._take_background(self._ipoly)
+            self.modelax.draw_artist(self.polygons[self._ipoly])
+            self.modelax.draw_artist(self.lines[self._ipoly])
+
+    def _resize_callback(self, event):
+        """
+        Invalidate the cached backgrounds and vertices display coordinates
+        when the figure is resized.
+        """
+        self._dataax_bg = None
+        self._vertices_display = None
+        self.background = None
+
+    def _limits_changed_callback(self, ax):
+        """
+        Invalidate the cached vertices display coordinates and the
+        backgrounds on zoom and pan (the x axis is shared with the *dataax*).
+        """
+        self._vertices_display = None
+        self._dataax_bg = None
+        self.background = None
 
     def _density2color(self, density):
         """
         Map density values to colors using the given *cmap* attribute.
 
+        Colors are read straight from a lookup table of the colormap instead
+        of calling it on every slider event.
+
         Parameters:
 
         * density : 1d-array
@@ -273,7 +498,9 @@ class Moulder(FigureCanvasQTAgg):
 
         """
         dmin, dmax = self.density_range
-        return self.cmap((density - dmin)/(dmax - dmin))
+        nlut = len(self._cmap_lut)
+        index = numpy.clip(nlut*(density - dmin)/(dmax - dmin), 0, nlut - 1)
+        return self._cmap_lut[index.astype(int)]
 
     def _make_polygon(self, vertices, density):
         """
@@ -297,23 +524,220 @@ class Moulder(FigureCanvasQTAgg):
         """
         poly = patches.Polygon(vertices, animated=False, alpha=0.9,
                                color=self._density2color(density))
-        x, y = list(zip(*poly.xy))
-        line = Line2D(x, y, **LINE_ARGS)
+        line = Line2D(poly.xy[:, 0], poly.xy[:, 1], **LINE_ARGS)
         return poly, line
 
+    def _clear_highlight(self):
+        """
+        Stop animating and hide the contour of the highlighted polygon.
+        """
+        if self._animated_idx is not None:
+            self.polygons[self._animated_idx].set_animated(False)
+            self.lines[self._animated_idx].set_animated(False)
+            self.lines[self._animated_idx].set_color([0, 0, 0, 0])
+            self._animated_idx = None
+
+    def _polygon_slice(self, ipoly):
+        """
+        Get the slice of the vertex arrays that holds a polygon.
+        """
+        return slice(self._poly_offsets[ipoly], self._poly_offsets[ipoly + 1])
+
+    def _polygon_vertices(self, ipoly):
+        """
+        Get the [x, z] coordinates of the vertices of a polygon.
+        """
+        verts = self._polygon_slice(ipoly)
+        return numpy.column_stack((self._verts_x[verts], self._verts_z[verts]))
+
+    def _sync_polygon(self, ipoly):
+        """
+        Copy the vertices of a polygon to its patch and contour for drawing.
+
+        The vertices of the patch are overwritten in place if their number
+        didn't change.
+        """
+        verts = self._polygon_slice(ipoly)
+        poly = self.polygons[ipoly]
+        xy = poly.xy
+        if len(xy) == verts.stop - verts.start + 1:
+            xy[:-1, 0] = self._verts_x[verts]
+            xy[:-1, 1] = self._verts_z[verts]
+            xy[-1] = xy[0]
+        else:
+            poly.set_xy(self._polygon_vertices(ipoly))
+            xy = poly.xy
+        self.lines[ipoly].set_data(xy[:, 0], xy[:, 1])
+
+    def _update_data(self):
+        """
+        Recompute the predicted data from the current polygon model.
+
+        The forward model runs in a worker thread and the data plot is updated
+        when it finishes. Only one computation runs at a time: a request made
+        in the meantime waits for it, replacing any other waiting request.
+        Results of outdated requests are discarded.
+        """
+        self._request_id += 1
+        if _talwani_numba is not None:
+            densities = numpy.array(self.densities, dtype=numpy.float64)
+            forward = _talwani_numba.gz
+            # Dragging modifies the vertices in place, so the worker gets a
+            # copy of them
+            args = (self.x, self.z, self._verts_x.copy(),
+                    self._verts_z.copy(), self._poly_offsets.copy(),
+                    densities)
+        else:
+            forward = _talwani_gz
+            args = (self.x, self.z, self.model)
+        # A task only starts after the running one finished and only the
+        # result of the latest request is plotted, so the buffer that isn't
+        # plotted is free
+        if self._predicted is self._predicted_buffers[0]:
+            out = self._predicted_buffers[1]
+        else:
+            out = self._predicted_buffers[0]
+        task = _ForwardModelTask(self._request_id, forward, args, self.error,
+                                 out, self._noise_buffer)
+        task.signals.finished.connect(self._forward_model_callback)
+        if self._forward_task is None:
+            self._start_forward_task(task)
+        else:
+            self._pending_task = task
+
+    def _start_forward_task(self, task):
+        """
+        Run a forward model task in the global thread pool.
+        """
+        self._forward_task = task
+        QThreadPool.globalInstance().start(task)
+
+    def _forward_model_callback(self, request_id, predicted, pmin, pmax):
+        """
+        Plot the predicted data computed by the worker thread.
+        """
+        self._forward_task = None
+        if self._pending_task is not None:
+            self._start_forward_task(self._pending_task)
+            self._pending_task = None
+        if request_id == self._request_id:
+            self._predicted = predicted
+            self._predicted_range = (pmin, pmax)
+            self._update_data_plot()
+
+    def _delayed_update_callback(self):
+        """
+        Update the predicted data once the density and error sliders settle.
+        """
+        self._update_data()
+        if self._model_changed:
+            self._model_changed = False
+            self.canvas.draw_idle()
+
+    def _take_background(self, ipoly):
+        """
+        Take a snapshot of the model axes to blit on top of.
+
+        Parameters:
+
+        * ipoly : int or None
+            The polygon left out of the snapshot (the selected one), if any
+
+        """
+        self.background = self.canvas.copy_from_bbox(self.modelax.bbox)
+        self._background_ipoly = ipoly
+        self._background_bounds = self.modelax.bbox.bounds
+
+    def _has_background(self):
+        """
+        Check if there is a snapshot of the model axes that can be blitted.
+
+        A snapshot is outdated if the model axes moved within the figure
+        since it was taken (e.g., with subplots_adjust), because the redraws
+        after that only take a new one if a polygon is animated.
+        """
+        return (self.background is not None and
+                self._background_bounds == self.modelax.bbox.bounds)
+
+    def _blit_selected_polygon(self):
+        """
+        Blit the selected polygon if the cached background was taken for it.
+
+        The background leaves out the selected polygon, so this avoids a full
+        redraw when only the selected polygon changed.
+
+        Returns:
+
+        * blitted : bool
+            True if the selected polygon was blitted.
+
+        """
+        if (self._ipoly is None or not self._has_background() or
+                self._background_ipoly != self._ipoly):
+            return False
+        self._blit_polygon(self._ipoly)
+        return True
+
+    def _blit_polygon(self, ipoly):
+        """
+        Blit a polygon and its contour on top of the model axes background.
+
+        Schedules a redraw instead if there is no valid background (it is
+        taken again in _draw_callback).
+        """
+        if not self._has_background():
+            self.canvas.draw_idle()
+            return
+        self.canvas.restore_region(self.background)
+        self.modelax.draw_artist(self.polygons[ipoly])
+        self.modelax.draw_artist(self.lines[ipoly])
+        self.canvas.blit(self.modelax.bbox)
+
+    def _blit_drawing(self):
+        """
+        Blit the polygon being drawn on top of the model axes background.
+
+        Schedules a redraw instead if there is no valid background (it is
+        taken again in _draw_callback).
+        """
+        if not self._has_background():
+            self.canvas.draw_idle()
+            return
+        self.canvas.restore_region(self.background)
+        self.modelax.draw_artist(self._drawing_plot)
+        self.canvas.blit(self.modelax.bbox)
+
     def _update_data_plot(self):
         """
         Update the predicted data plot in the *dataax*.
 
-        Adjusts the xlim of the axes to fit the data.
+        Adjusts the ylim of the axes to fit the data. The limits are only
+        changed if the data falls outside of them or if they are off by more
+        than *ylim_tolerance* (a fraction of the current range), so small
+        changes of the data don't rescale the axes. A redraw of the whole
+        figure is only scheduled when the limits change, otherwise the
+        predicted line is blitted on top of the cached background.
         """
-        predicted = self.predicted
-        self.predicted_line.set_ydata(predicted)
-        vmin = 1.2*min(predicted.min(), self.dmin)
-        vmax = 1.2*max(predicted.max(), self.dmax)
-        self.dataax.set_ylim(vmin, vmax)
-        self.dataax.grid(True)
-        self.canvas.draw()
+        self.predicted_line.set_ydata(self.predicted)
+        pmin, pmax = self._predicted_range
+        pmin, pmax = min(pmin, self.dmin), max(pmax, self.dmax)
+        vmin, vmax = 1.2*pmin, 1.2*pmax
+        # Read the limits from the axes because the toolbar can change them
+        ymin, ymax = self.dataax.get_ylim()
+        tolerance = self.ylim_tolerance*(ymax - ymin)
+        # Matplotlib expands equal limits, so they never match the fitted
+        # ones (e.g., before there are any polygons)
+        off = vmin != vmax and (abs(vmin - ymin) > tolerance or
+                                abs(vmax - ymax) > tolerance)
+        if pmin < ymin or pmax > ymax or off:
+            self.dataax.set_ylim(vmin, vmax)
+            self.canvas.draw_idle()
+        elif self._dataax_bg is None:
+            self.canvas.draw_idle()
+        else:
+            self.canvas.restore_region(self._dataax_bg)
+            self.dataax.draw_artist(self.predicted_line)
+            self.canvas.blit(self.dataax.bbox)
 
     def _get_polygon_vertice_id(self, event):
         """
@@ -331,15 +755,12 @@ class Moulder(FigureCanvasQTAgg):
             click was not on a vertex.
 
         """
-        distances = []
-        indices = []
-        for poly in self.polygons:
-            x, y = poly.get_transform().transform(poly.xy).T
-            d = numpy.sqrt((x - event.x)**2 + (y - event.y)**2)
-            distances.append(d.min())
-            indices.append(numpy.argmin(d))
-        p = numpy.argmin(distances)
-        if distances[p] >= self.epsilon:
+        vertices = self._get_vertices_display()
+        dx = vertices[:, 0] - event.x
+        dy = vertices[:, 1] - event.y
+        distances = dx*dx + dy*dy
+        closest = distances.argmin()
+        if distances[closest] >= self.epsilon**2:
             # Check if the event was inside a polygon
             x, y = event.x, event.y
             p, v = None, None
@@ -348,32 +769,63 @@ class Moulder(FigureCanvasQTAgg):
                     p = i
                     break
         else:
-            v = indices[p]
-            last = len(self.polygons[p].xy) - 1
-            if v == 0 or v == last:
-                v = [0, last]
+            p = int(numpy.searchsorted(self._poly_offsets, closest,
+                                       side='right')) - 1
+            v = int(closest - self._poly_offsets[p])
         return p, v
 
+    def _get_vertices_display(self):
+        """
+        Get the display coordinates of the vertices of all polygons.
+
+        The coordinates are cached in a single array so a click can be tested
+        against every vertex at once. The cache must be reset (set to None)
+        whenever polygons are added or removed, the number of vertices of a
+        polygon changes or the view is zoomed, panned or resized. It is also
+        rebuilt if the model axes moved within the figure (e.g., with
+        subplots_adjust). Polygons that were only moved are added to
+        *_moved_polygons* and just their vertices are transformed again.
+
+        Returns:
+
+        * vertices : 2d-array
+            The display coordinates of the vertices of all polygons, in the
+            same order as the vertex arrays.
+
+        """
+        bounds = self.modelax.bbox.bounds
+        if (self._vertices_display is None or
+                self._vertices_display_bounds != bounds):
+            self._vertices_display = self.modelax.transData.transform(
+                numpy.column_stack((self._verts_x, self._verts_z)))
+            self._vertices_display_bounds = bounds
+        else:
+            for p in self._moved_polygons:
+                verts = self._polygon_slice(p)
+                self._vertices_display[verts] = \
+                    self.modelax.transData.transform(
+                        self._polygon_vertices(p))
+        self._moved_polygons.clear()
+        return self._vertices_display
+
     def _add_new_vertex(self, event):
         """
         Add new vertex to polygon
         """
-        vertices = self.polygons[self._ipoly].get_xy()
-        x, y = vertices[:, 0], vertices[:, 1]
+        verts = self._polygon_slice(self._ipoly)
+        # Close the polygon by repeating the first vertex so the segments go
+        # from x[:-1] to x[1:]
+        x = numpy.append(self._verts_x[verts], self._verts_x[verts.start])
+        y = numpy.append(self._verts_z[verts], self._verts_z[verts.start])
         # Compute the angle between the vectors to each pair of
-        # vertices corresponding to each line segment of the polygon
-        x1, y1 = x[:-1], y[:-1]
-        x2, y2 = numpy.roll(x1, -1), numpy.roll(y1, -1)
-        u = numpy.vstack((x1 - event.xdata, y1 - event.ydata)).T
-        v = numpy.vstack((x2 - event.xdata, y2 - event.ydata)).T
-        angle = numpy.arccos(numpy.sum(u*v, 1) /
-                             numpy.sqrt(numpy.sum(u**2, 1)) /
-                             numpy.sqrt(numpy.sum(v**2, 1)))
-        position = angle.argmax() + 1
-        x = numpy.hstack((x[:position], event.xdata, x[position:]))
-        y = numpy.hstack((y[:position], event.ydata, y[position:]))
-        new_vertices = numpy.vstack((x, y)).T
-        return new_vertices
+        # vertices corresponding to each line segment of the polygon.
+        ux, uy = x[:-1] - event.xdata, y[:-1] - event.ydata
+        vx, vy = x[1:] - event.xdata, y[1:] - event.ydata
+        angle = numpy.arctan2(numpy.abs(ux*vy - uy*vx), ux*vx + uy*vy)
+        index = verts.start + angle.argmax() + 1
+        self._verts_x = numpy.insert(self._verts_x, index, event.xdata)
+        self._verts_z = numpy.insert(self._verts_z, index, event.ydata)
+        self._poly_offsets[self._ipoly + 1:] += 1
 
     def _button_press_callback(self, event):
         """
@@ -384,62 +836,64 @@ class Moulder(FigureCanvasQTAgg):
         if event.button == 1 and not self._drawing and self.polygons:
             self._lastevent = event
             if not self._add_vertex:
-                for line, poly in zip(self.lines, self.polygons):
-                    poly.set_animated(False)
-                    line.set_animated(False)
-                    line.set_color([0, 0, 0, 0])
-                self.canvas.draw()
+                self._clear_highlight()
                 # Find out if a click happened on a vertice
                 # and which vertice of which polygon
                 self._ipoly, self._ivert = self._get_polygon_vertice_id(event)
                 if self._ipoly is not None:
-                    # Emit signal: selected polygon changed (sends density)
-                    self.polygon_selected.emit(self.densities[self._ipoly])
+                    # Emit signal: selected polygon changed (sends density).
+                    # The density widgets are only synced, so the current
+                    # density is set here.
+                    self._density = self.densities[self._ipoly]
+                    self.polygon_selected.emit(self._density)
                     # self.density_slider.set_val(self.densities[self._ipoly])
                     self.polygons[self._ipoly].set_animated(True)
                     self.lines[self._ipoly].set_animated(True)
                     self.lines[self._ipoly].set_color([0, 1, 0, 0])
-                    self.canvas.draw()
-                    self.background = self.canvas.copy_from_bbox(
-                        self.modelax.bbox)
-                    self.modelax.draw_artist(self.polygons[self._ipoly])
-                    self.modelax.draw_artist(self.lines[self._ipoly])
-                    self.canvas.blit(self.modelax.bbox)
+                    self._animated_idx = self._ipoly
+                    # Only take a new snapshot of the background if the
+                    # cached one is outdated or was taken for another polygon
+                    # (the snapshot is taken in _draw_callback)
+                    if (not self._has_background() or
+                            self._background_ipoly != self._ipoly):
+                        self.canvas.draw()
+                    else:
+                        self._blit_polygon(self._ipoly)
+                else:
+                    self.canvas.draw_idle()
             else:
-                # If a polygon is selected, we will add a new vertex by
-                # removing the polygon and inserting a new one with the extra
-                # vertex.
+                # If a polygon is selected, add a new vertex to it and update
+                # its patch and contour in place
                 if self._ipoly is not None:
-                    vertices = self._add_new_vertex(event)
-                    density = self.densities[self._ipoly]
-                    polygon, line = self._make_polygon(vertices, density)
-                    self.polygons[self._ipoly].remove()
-                    self.lines[self._ipoly].remove()
-                    self.polygons.pop(self._ipoly)
-                    self.lines.pop(self._ipoly)
-                    self.polygons.insert(self._ipoly, polygon)
-                    self.lines.insert(self._ipoly, line)
-                    self.modelax.add_patch(polygon)
-                    self.modelax.add_line(line)
-                    self.lines[self._ipoly].set_color([0, 1, 0, 0])
-                    self.canvas.draw()
-                    # self._update_data()
-                    self._update_data_plot()
+                    self._add_new_vertex(event)
+                    self._sync_polygon(self._ipoly)
+                    self._vertices_display = None
+                    self._dirty_polys.add(self._ipoly)
+                    if not self._blit_selected_polygon():
+                        self.canvas.draw_idle()
+                    self._update_data()
         elif self._drawing:
             if event.button == 1:
                 self._xy.append([event.xdata, event.ydata])
-                self._drawing_plot.set_data(list(zip(*self._xy)))
-                self.canvas.restore_region(self.background)
-                self.modelax.draw_artist(self._drawing_plot)
-                self.canvas.blit(self.modelax.bbox)
+                self._drawing_plot.set_data(*numpy.transpose(self._xy))
+                self._blit_drawing()
             elif event.button == 3:
                 if len(self._xy) >= 3:
                     poly, line = self._make_polygon(self._xy, self.density)
                     self.polygons.append(poly)
                     self.lines.append(line)
                     self.densities.append(self.density)
+                    self._model_cache.append(None)
+                    self._dirty_polys.add(len(self._model_cache) - 1)
+                    xy = numpy.asarray(self._xy, dtype=numpy.float64)
+                    self._verts_x = numpy.append(self._verts_x, xy[:, 0])
+                    self._verts_z = numpy.append(self._verts_z, xy[:, 1])
+                    self._poly_offsets = numpy.append(
+                        self._poly_offsets, self._poly_offsets[-1] + len(xy))
                     self.modelax.add_patch(poly)
                     self.modelax.add_line(line)
+                    self._vertices_display = None
+                    self.background = None
                     self._drawing_plot.remove()
                     self._drawing_plot = None
                     self._xy = None
@@ -447,10 +901,10 @@ class Moulder(FigureCanvasQTAgg):
                     self.drawing_mode.emit(self._drawing)
                     self._ipoly = len(self.polygons) - 1
                     self.lines[self._ipoly].set_color([0, 1, 0, 0])
+                    self._animated_idx = self._ipoly
                     self.dataax.set_title(self.instructions)
-                    self.canvas.draw()
-                    # self._update_data()
-                    self._update_data_plot()
+                    self.canvas.draw_idle()
+                    self._update_data()
 
     def _button_release_callback(self, event):
         """
@@ -465,17 +919,15 @@ class Moulder(FigureCanvasQTAgg):
             self.add_vertex_mode.emit(False)
         if self._ivert is None and self._ipoly is None:
             return
-        self.background = None
-        for line, poly in zip(self.lines, self.polygons):
-            poly.set_animated(False)
-            line.set_animated(False)
-        self.canvas.draw()
+        if self._animated_idx is not None:
+            self.polygons[self._animated_idx].set_animated(False)
+            self.lines[self._animated_idx].set_animated(False)
+        self.canvas.draw_idle()
         self._ivert = None
         # self._ipoly is only released when clicking outside
         # the polygons
         self._lastevent = None
-        # self._update_data()
-        self._update_data_plot()
+        self._update_data()
 
     def _mouse_move_callback(self, event):
         """
@@ -492,33 +944,25 @@ class Moulder(FigureCanvasQTAgg):
         x, y = event.xdata, event.ydata
         p = self._ipoly
         v = self._ivert
+        verts = self._polygon_slice(p)
         if self._ivert is not None:
-            self.polygons[p].xy[v] = x, y
+            self._verts_x[verts.start + v] = x
+            self._verts_z[verts.start + v] = y
         else:
             dx = x - self._lastevent.xdata
             dy = y - self._lastevent.ydata
-            self.polygons[p].xy[:, 0] += dx
-            self.polygons[p].xy[:, 1] += dy
-        self.lines[p].set_data(list(zip(*self.polygons[p].xy)))
+            self._verts_x[verts] += dx
+            self._verts_z[verts] += dy
+        self._moved_polygons.add(p)
+        self._dirty_polys.add(p)
+        self._sync_polygon(p)
         self._lastevent = event
-        self.canvas.restore_region(self.background)
-        self.modelax.draw_artist(self.polygons[p])
-        self.modelax.draw_artist(self.lines[p])
-        self.canvas.blit(self.modelax.bbox)
+        self._blit_polygon(p)
 
     def keyPressEvent(self, event):
         """
         What to do when a key is pressed on the keyboard.
         """
-        if event.key() == Qt.Key_D:
-            self.delete_polygon()
-        elif event.key() == Qt.Key_N:
-            self.new_polygon()
-        elif event.key() == Qt.Key_Escape:
-            self.cancel_drawing()
-        elif event.key() == Qt.Key_R:
-            self.modelax.set_xlim(self.x.min(), self.x.max())
-            self.modelax.set_ylim(self.max_depth, self.min_depth)
-            self._update_data_plot()
-        elif event.key() == Qt.Key_A:
-            self.add_vertex()
+        action = KEY_ACTIONS.get(event.key())
+        if action is not None:
+            getattr(self, action)()
@@ -0,0 +1,47 @@
+"""
+Test the conversions between float values and QDoubleSlider positions.
+"""
+import os
+
+import numpy
+import numpy.testing as npt
+import pytest
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+pytest.importorskip('PyQt5')
+from PyQt5.QtCore import Qt  # noqa: E402
+from PyQt5.QtWidgets import QApplication  # noqa: E402
+
+from ..ui import double_slider  # noqa: E402
+from ..ui import QDoubleSlider  # noqa: E402
+
+APP = QApplication.instance() or QApplication([])
+
+# Include values below the minimum, so the offsets are negative
+VALUES = numpy.linspace(-1.3, 5.7, 71)
+
+
+@pytest.fixture(params=['numba', 'numpy'])
+def slider(request, monkeypatch):
+    "A QDoubleSlider using the numba or the NumPy batch conversion"
+    if request.param == 'numba':
+        pytest.importorskip('numba')
+        assert double_slider.batch_float_to_int is not None
+    else:
+        monkeypatch.setattr(double_slider, 'batch_float_to_int', None)
+    return QDoubleSlider(Qt.Horizontal, 0, 5, 0.5)
+
+
+def test_batch_float_2_int(slider):
+    "batch_float_2_int matches float_2_int on every value"
+    positions = slider.batch_float_2_int(VALUES)
+    assert positions.dtype == numpy.int32
+    npt.assert_array_equal(positions,
+                           [slider.float_2_int(v) for v in VALUES])
+
+
+def test_batch_float_2_int_truncates(slider):
+    "Positions are truncated towards zero like int()"
+    positions = slider.batch_float_2_int([-0.75, -0.25, 0.25, 0.75])
+    assert positions.dtype == numpy.int32
+    npt.assert_array_equal(positions, [-1, 0, 0, 1])
@@ -0,0 +1,212 @@
+"""
+Test the Moulder canvas.
+"""
+import io
+import os
+
+import numpy
+import numpy.testing as npt
+import pytest
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+pytest.importorskip('PyQt5')
+from PyQt5.QtCore import QThreadPool  # noqa: E402
+from PyQt5.QtWidgets import QApplication  # noqa: E402
+from matplotlib.backend_bases import MouseEvent  # noqa: E402
+
+from ..moulder import Moulder  # noqa: E402
+
+APP = QApplication.instance() or QApplication([])
+
+POLYGONS = [
+    [[10e3, 1e3], [20e3, 1e3], [20e3, 3e3], [10e3, 3e3]],
+    [[30e3, 2e3], [40e3, 2e3], [35e3, 5e3]],
+    [[50e3, 1e3], [60e3, 1e3], [65e3, 3e3], [60e3, 6e3], [50e3, 4e3]],
+]
+
+
+def _click(moulder, x, z, button=1):
+    "Send a mouse button press at the given data coordinates"
+    xp, yp = moulder.modelax.transData.transform((x, z))
+    event = MouseEvent('button_press_event', moulder.canvas, xp, yp,
+                       button=button)
+    moulder._button_press_callback(event)
+
+
+def test_meassurement_points_float64():
+    "Measurement points are converted to double precision"
+    x = numpy.linspace(0, 500e3, 11, dtype=numpy.float32)
+    moulder = Moulder(None, x, numpy.zeros(11, dtype=numpy.float32), 0, 10e3)
+    assert moulder.x.dtype == numpy.float64
+    assert moulder.z.dtype == numpy.float64
+    npt.assert_array_equal(moulder.x, x)
+    x = numpy.linspace(0, 200e3, 21, dtype=numpy.float32)
+    moulder.set_meassurement_points(x, numpy.zeros(21, dtype=numpy.float32))
+    assert moulder.x.dtype == numpy.float64
+    assert moulder.z.dtype == numpy.float64
+    npt.assert_array_equal(moulder.x, x)
+    QThreadPool.globalInstance().waitForDone()
+
+
+@pytest.fixture
+def moulder():
+    "A Moulder canvas with the polygons in POLYGONS drawn on it"
+    x = numpy.linspace(0, 100e3, 51)
+    z = numpy.zeros_like(x)
+    moulder = Moulder(None, x, z, 0, 10e3)
+    for vertices in POLYGONS:
+        moulder.new_polygon()
+        for vertex in vertices:
+            _click(moulder, *vertex)
+        _click(moulder, *vertices[0], button=3)
+    yield moulder
+    QThreadPool.globalInstance().waitForDone()
+
+
+def _check_vertices(moulder, expected):
+    "Check the packed vertices against the expected vertices of each polygon"
+    assert len(moulder.polygons) == len(expected)
+    assert len(moulder._model_cache) == len(expected)
+    assert moulder._poly_offsets[0] == 0
+    assert moulder._poly_offsets[-1] == moulder._verts_x.size
+    assert moulder._verts_x.size == moulder._verts_z.size
+    npt.assert_array_equal(numpy.diff(moulder._poly_offsets),
+                           [len(vertices) for vertices in expected])
+    for i, vertices in enumerate(expected):
+        npt.assert_allclose(moulder._polygon_vertices(i), vertices)
+        npt.assert_allclose(moulder.polygons[i].xy[:-1], vertices)
+    model = moulder.model
+    for polygon, vertices in zip(model, expected):
+        assert polygon.nverts == len(vertices)
+
+
+def test_draw_polygons(moulder):
+    "Drawn polygons are appended to the packed vertices"
+    _check_vertices(moulder, POLYGONS)
+
+
+@pytest.mark.parametrize('ipoly', [0, 1, 2])
+def test_delete_polygon(moulder, ipoly):
+    "Deleting a polygon shifts the offsets of the following ones"
+    moulder._dirty_polys.update(range(len(POLYGONS)))
+    moulder._ipoly, moulder._ivert = ipoly, None
+    moulder._animated_idx = 2
+    moulder.delete_polygon()
+    expected = POLYGONS[:ipoly] + POLYGONS[ipoly + 1:]
+    assert moulder._dirty_polys == set(range(len(expected)))
+    if ipoly == 2:
+        assert moulder._animated_idx is None
+    else:
+        assert moulder._animated_idx == 1
+    _check_vertices(moulder, expected)
+
+
+def test_delete_polygons(moulder):
+    "Deleting all polygons one by one leaves the vertex arrays empty"
+    for ipoly in [1, 0, 0]:
+        moulder._ipoly, moulder._ivert = ipoly, None
+        moulder.delete_polygon()
+    _check_vertices(moulder, [])
+    assert moulder.model == []
+
+
+@pytest.mark.parametrize('ipoly,ivert', [(0, 0), (0, 3), (2, 2), (2, 4)])
+def test_delete_vertex(moulder, ipoly, ivert):
+    "Deleting a vertex shifts the offsets of the following polygons"
+    moulder._ipoly, moulder._ivert = ipoly, ivert
+    moulder.delete_polygon()
+    expected = [list(vertices) for vertices in POLYGONS]
+    expected[ipoly].pop(ivert)
+    _check_vertices(moulder, expected)
+
+
+def test_delete_vertex_triangle(moulder):
+    "Polygons can't have less than 3 vertices"
+    moulder._ipoly, moulder._ivert = 1, 0
+    moulder.delete_polygon()
+    _check_vertices(moulder, POLYGONS)
+
+
+def test_add_vertex_closing_segment(moulder):
+    "A vertex added on the closing segment goes after the last vertex"
+    moulder._ipoly, moulder._ivert = 0, None
+    moulder.add_vertex()
+    _click(moulder, 9.9e3, 2e3)
+    expected = [list(vertices) for vertices in POLYGONS]
+    expected[0].append([9.9e3, 2e3])
+    _check_vertices(moulder, expected)
+
+
+def test_add_vertex_middle_segment(moulder):
+    "A vertex added between two vertices goes between them"
+    moulder._ipoly, moulder._ivert = 1, None
+    moulder.add_vertex()
+    _click(moulder, 35e3, 1.9e3)
+    expected = [list(vertices) for vertices in POLYGONS]
+    expected[1].insert(1, [35e3, 1.9e3])
+    _check_vertices(moulder, expected)
+
+
+def test_density_rebuilds_model(moulder):
+    "Changing the density doesn't modify Polygons returned by model before"
+    old_model = moulder.model
+    moulder._ipoly = 1
+    moulder.density = 1234.
+    new_model = moulder.model
+    assert old_model[1].props['density'] != 1234.
+    assert new_model[1].props['density'] == 1234.
+    assert new_model[0] is old_model[0]
+    assert new_model[2] is old_model[2]
+
+
+def test_vertices_display_subplots_adjust(moulder):
+    "Vertices can be picked after the axes are moved within the figure"
+    moulder._get_vertices_display()
+    moulder.fig.subplots_adjust(left=0.3, bottom=0.3)
+    moulder.draw()
+    xp, yp = moulder.modelax.transData.transform(POLYGONS[0][2])
+    event = MouseEvent('button_press_event', moulder.canvas, xp, yp)
+    assert moulder._get_polygon_vertice_id(event) == (0, 2)
+
+
+def test_background_subplots_adjust(moulder):
+    "The blit background isn't used after the axes move within the figure"
+    _click(moulder, 15e3, 2e3)
+    xp, yp = moulder.modelax.transData.transform((15e3, 2e3))
+    moulder._button_release_callback(
+        MouseEvent('button_release_event', moulder.canvas, xp, yp, button=1))
+    assert moulder._ipoly == 0
+    assert moulder._blit_selected_polygon()
+    moulder.fig.subplots_adjust(left=0.3, bottom=0.3)
+    moulder.draw()
+    assert not moulder._blit_selected_polygon()
+
+
+@pytest.mark.parametrize('fmt', ['png', 'svg', 'pdf'])
+def test_savefig_keeps_backgrounds(moulder, fmt):
+    "Saving the figure doesn't replace the blit backgrounds"
+    _click(moulder, 15e3, 2e3)
+    dataax_bg, background = moulder._dataax_bg, moulder.background
+    assert background is not None
+    moulder.fig.savefig(io.BytesIO(), format=fmt, dpi=300)
+    assert moulder._dataax_bg is dataax_bg
+    assert moulder.background is background
+
+
+def test_reset_view_fits_data(moulder):
+    "Resetting the view fits the data axes again after a zoom"
+    moulder._predicted_range = (-50, 80)
+    moulder._update_data_plot()
+    npt.assert_allclose(moulder.dataax.get_ylim(), (-60, 96))
+    moulder.dataax.set_ylim(0, 10)
+    moulder.reset_view()
+    npt.assert_allclose(moulder.dataax.get_ylim(), (-60, 96))
+
+
+def test_predicted_read_only(moulder):
+    "The predicted data can't be modified through the property"
+    predicted = moulder.predicted
+    assert not predicted.flags.writeable
+    with pytest.raises(ValueError):
+        predicted[0] = 1
+    assert moulder._predicted.flags.writeable
@@ -0,0 +1,113 @@
+"""
+Test the numba implementation of the Talwani forward model against fatiando.
+"""
+import numpy
+import numpy.testing as npt
+import pytest
+
+from fatiando.gravmag import talwani
+from fatiando.mesher import Polygon
+
+_talwani_numba = pytest.importorskip('moulder._talwani_numba')
+
+
+def _random_polygon(rng, nverts, center, radius, clockwise):
+    "A random star shaped polygon with the given orientation"
+    angles = numpy.sort(rng.uniform(0, 2*numpy.pi, nverts))
+    radii = radius*rng.uniform(0.5, 1, nverts)
+    vertices = numpy.transpose([center[0] + radii*numpy.cos(angles),
+                                center[1] + radii*numpy.sin(angles)])
+    # Increasing angles are clockwise when z points downward
+    if not clockwise:
+        vertices = vertices[::-1]
+    return vertices
+
+
+def _pack(polygons):
+    "Pack the vertices of the polygons the way Moulder stores them"
+    sizes = [len(p) for p in polygons]
+    offsets = numpy.cumsum([0] + sizes).astype(numpy.int32)
+    if polygons:
+        vertices = numpy.concatenate(polygons)
+    else:
+        vertices = numpy.empty((0, 2))
+    return vertices[:, 0].copy(), vertices[:, 1].copy(), offsets
+
+
+def _fatiando_gz(x, z, polygons, densities):
+    model = [Polygon(p, {'density': d}, force_clockwise=True)
+             for p, d in zip(polygons, densities)]
+    return talwani.gz(x, z, model)
+
+
+def _computation_points(rng, npoints=50):
+    x = numpy.sort(rng.uniform(-10e3, 10e3, npoints))
+    z = numpy.full(npoints, -10.)
+    return x, z
+
+
+@pytest.mark.parametrize('clockwise', [True, False])
+def test_gz_single_polygon(clockwise):
+    "gz of a random polygon matches fatiando in either orientation"
+    rng = numpy.random.default_rng(0)
+    x, z = _computation_points(rng)
+    for _ in range(5):
+        polygon = _random_polygon(rng, 8, (0, 3000), 2000, clockwise)
+        density = rng.uniform(-500, 500)
+        vx, vz, offsets = _pack([polygon])
+        result = _talwani_numba.gz(x, z, vx, vz, offsets,
+                                   numpy.array([density]))
+        npt.assert_allclose(result, _fatiando_gz(x, z, [polygon], [density]),
+                            rtol=1e-6, atol=1e-10)
+
+
+def test_gz_several_polygons():
+    "gz of polygons packed together is the sum of each polygon"
+    rng = numpy.random.default_rng(1)
+    x, z = _computation_points(rng)
+    polygons = [_random_polygon(rng, n, (c, 2000 + 500*i), 1000, i % 2 == 0)
+                for i, (n, c) in enumerate(zip([3, 7, 4, 12],
+                                               [-6e3, -2e3, 2e3, 6e3]))]
+    densities = rng.uniform(-500, 500, len(polygons))
+    vx, vz, offsets = _pack(polygons)
+    result = _talwani_numba.gz(x, z, vx, vz, offsets, densities)
+    npt.assert_allclose(result, _fatiando_gz(x, z, polygons, densities),
+                        rtol=1e-6, atol=1e-10)
+
+
+def test_gz_empty_model():
+    "gz without polygons is zero everywhere"
+    rng = numpy.random.default_rng(2)
+    x, z = _computation_points(rng)
+    vx, vz, offsets = _pack([])
+    result = _talwani_numba.gz(x, z, vx, vz, offsets, numpy.empty(0))
+    npt.assert_array_equal(result, numpy.zeros_like(x))
+
+
+def test_gz_out():
+    "gz writes to and returns the out array if given"
+    rng = numpy.random.default_rng(3)
+    x, z = _computation_points(rng)
+    polygon = _random_polygon(rng, 6, (0, 2000), 1500, True)
+    vx, vz, offsets = _pack([polygon])
+    densities = numpy.array([300.])
+    out = numpy.full_like(x, numpy.nan)
+    result = _talwani_numba.gz(x, z, vx, vz, offsets, densities, out=out)
+    assert result is out
+    expected = _talwani_numba.gz(x, z, vx, vz, offsets, densities)
+    npt.assert_allclose(out, expected)
+
+
+def test_gz_float32_points():
+    "gz with float32 computation points matches the float64 result"
+    rng = numpy.random.default_rng(4)
+    x, z = _computation_points(rng)
+    polygon = _random_polygon(rng, 6, (0, 2000), 1500, False)
+    vx, vz, offsets = _pack([polygon])
+    densities = numpy.array([300.])
+    x32, z32 = x.astype(numpy.float32), z.astype(numpy.float32)
+    result = _talwani_numba.gz(x32, z32, vx, vz, offsets, densities)
+    assert result.dtype == numpy.float64
+    expected = _fatiando_gz(x32.astype(numpy.float64),
+                            z32.astype(numpy.float64), [polygon], densities)
+    npt.assert_allclose(result, expected, rtol=1e-5, atol=1e-8)
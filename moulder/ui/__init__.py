@@ -1,3 +1,10 @@
-from __future__ import absolute_import
-from .configure_dialog import ConfigureMeassurementDialog
 from .double_slider import QDoubleSlider
+
+
+def __getattr__(name):
+    # The dialog is only imported when it's first opened
+    if name == 'ConfigureMeassurementDialog':
+        from .configure_dialog import ConfigureMeassurementDialog
+        return ConfigureMeassurementDialog
+    raise AttributeError(
+        "module {!r} has no attribute {!r}".format(__name__, name))
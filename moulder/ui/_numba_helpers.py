@@ -0,0 +1,34 @@
+"""
+Numba implementations of the batch conversions of the ui widgets.
+
+Used by :class:`~moulder.ui.QDoubleSlider` when numba is installed.
+"""
+
+import numpy
+import numba
+
+
+@numba.njit(cache=True, fastmath=True)
+def batch_float_to_int(values, min_value, scale):
+    """
+    Convert float values to integer slider positions.
+
+    Parameters:
+
+    * values : 1d-array
+        The float values
+    * min_value : float
+        The float value of the first slider position
+    * scale : float
+        The number of slider positions per unit of the float values
+
+    Returns:
+
+    * positions : 1d-array of int
+        The slider positions (truncated towards zero)
+
+    """
+    positions = numpy.empty(values.size, numpy.int32)
+    for i in range(values.size):
+        positions[i] = int((values[i] - min_value)*scale)
+    return positions
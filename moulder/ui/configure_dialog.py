@@ -1,12 +1,9 @@
-from __future__ import print_function, absolute_import
-from future.builtins import super
-
 import numpy
 from PyQt5.QtGui import QFont
 from PyQt5.QtCore import Qt
 from PyQt5.QtWidgets import QHBoxLayout, QVBoxLayout, QMessageBox, QLabel
 from PyQt5.QtWidgets import QDialog, QPushButton, QRadioButton
-from PyQt5.QtWidgets import QGridLayout, QLineEdit
+from PyQt5.QtWidgets import QGridLayout, QLineEdit, QWidget
 
 
 class ConfigureMeassurementDialog(QDialog):
@@ -16,22 +13,34 @@ class ConfigureMeassurementDialog(QDialog):
         self.setModal(False)
         self.setWindowTitle("Configure Meassurement Points")
         self._completed = False
+        # Parsed regular grid entries and x array, reset when the entries
+        # are edited (see _entries_changed_callback)
+        self._cached_entries = None
+        self._cached_x = None
         self._init_ui()
 
         self.regular_grid_btn.toggled.connect(self._radio_button_callback)
         self.custom_grid_btn.toggled.connect(self._radio_button_callback)
         self.cancel_btn.clicked.connect(self._button_pushed_callback)
         self.apply_btn.clicked.connect(self._button_pushed_callback)
+        for line_edit in [self.from_input, self.to_input, self.step_input,
+                          self.height_input]:
+            line_edit.textChanged.connect(self._entries_changed_callback)
 
     @property
     def x(self):
         if self.regular_grid_btn.isChecked():
-            entries = self._read_regular_grid_entries()
-            if entries:
+            if self._cached_x is None:
+                entries = self._read_regular_grid_entries()
+                if not entries:
+                    return None
                 x1, x2, step, z = entries[:]
-                return numpy.arange(x1, x2 + step/2, step, dtype=numpy.float64)
-            else:
-                return None
+                # Round to the closest number of steps so x2 is included
+                # despite floating point errors
+                n = max(int(round((x2 - x1)/step)) + 1, 0)
+                self._cached_x = numpy.linspace(x1, x1 + step*(n - 1), n,
+                                                dtype=numpy.float64)
+            return self._cached_x
         elif self.custom_grid_btn.isChecked():
             # Need to be completed
             pass
@@ -45,8 +54,9 @@ class ConfigureMeassurementDialog(QDialog):
         if self.regular_grid_btn.isChecked():
             entries = self._read_regular_grid_entries()
             if entries:
-                x1, x2, step, z = entries[:]
-                return -z*numpy.ones_like(self.x)
+                z = entries[3]
+                x = self.x
+                return numpy.full(x.shape, -z, dtype=numpy.float64)
             else:
                 return None
         elif self.custom_grid_btn.isChecked():
@@ -56,6 +66,11 @@ class ConfigureMeassurementDialog(QDialog):
     def is_completed(self):
         return self._completed
 
+    def showEvent(self, event):
+        # The dialog is reused, so it starts over every time it's shown
+        self._completed = False
+        super().showEvent(event)
+
     def _init_ui(self):
         self.regular_grid_btn = QRadioButton("Regular grid (in meters)")
         self.regular_grid_btn.setChecked(True)
@@ -84,7 +99,10 @@ class ConfigureMeassurementDialog(QDialog):
         grid.addWidget(self.step_input, 0, 5)
         grid.addWidget(QLabel("Meassurement Height:"), 1, 0)
         grid.addWidget(self.height_input, 1, 1, 1, 5)
-        layout.addLayout(grid)
+        # The regular grid inputs are enabled and disabled all at once
+        self._regular_grid_widget = QWidget()
+        self._regular_grid_widget.setLayout(grid)
+        layout.addWidget(self._regular_grid_widget)
 
         layout.addWidget(self.custom_grid_btn)
 
@@ -111,14 +129,12 @@ class ConfigureMeassurementDialog(QDialog):
                                     "completed or are incomplete.")
 
     def _radio_button_callback(self):
-        regular_grid_lines = [self.from_input, self.to_input,
-                              self.step_input, self.height_input]
-        if self.sender().text() == "Custom grid":
-            for line_edit in regular_grid_lines:
-                line_edit.setDisabled(True)
-        else:
-            for line_edit in regular_grid_lines:
-                line_edit.setEnabled(True)
+        self._regular_grid_widget.setEnabled(
+            self.regular_grid_btn.isChecked())
+
+    def _entries_changed_callback(self):
+        self._cached_entries = None
+        self._cached_x = None
 
     def _check_filled_entries(self):
         if self.regular_grid_btn.isChecked():
@@ -133,6 +149,11 @@ class ConfigureMeassurementDialog(QDialog):
             return False
 
     def _read_regular_grid_entries(self):
+        if self._cached_entries is None:
+            self._cached_entries = self._parse_regular_grid_entries()
+        return self._cached_entries
+
+    def _parse_regular_grid_entries(self):
         x1, x2 = self.from_input.text(), self.to_input.text()
         step = self.step_input.text()
         z = self.height_input.text()
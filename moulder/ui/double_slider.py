@@ -1,8 +1,11 @@
-from __future__ import division, absolute_import
-from future.builtins import super
-
+import numpy
 from PyQt5.QtWidgets import QSlider
 
+try:
+    from ._numba_helpers import batch_float_to_int
+except ImportError:
+    batch_float_to_int = None
+
 
 class QDoubleSlider(QSlider):
 
@@ -17,6 +20,9 @@ class QDoubleSlider(QSlider):
         true_max_value = min_value + step*self.nvalues
         if true_max_value != max_value:
             self.max_value = true_max_value
+        # Conversion factors between slider positions and float values
+        self._scale = (self.max_value - self.min_value)/self.nvalues
+        self._inv_scale = self.nvalues/(self.max_value - self.min_value)
 
         self.setMinimum(self.float_2_int(min_value))
         self.setMaximum(self.float_2_int(max_value))
@@ -24,10 +30,13 @@ class QDoubleSlider(QSlider):
             self.setValue(self.float_2_int(init_value))
 
     def int_2_float(self, value):
-        return (self.max_value - self.min_value)*value/self.nvalues + \
-               self.min_value
+        return value*self._scale + self.min_value
 
     def float_2_int(self, value):
-        return int(
-            self.nvalues*(value - self.min_value) /
-            (self.max_value - self.min_value))
+        return int((value - self.min_value)*self._inv_scale)
+
+    def batch_float_2_int(self, values):
+        values = numpy.ascontiguousarray(values, dtype=numpy.float64)
+        if batch_float_to_int is not None:
+            return batch_float_to_int(values, self.min_value, self._inv_scale)
+        return ((values - self.min_value)*self._inv_scale).astype(numpy.int32)